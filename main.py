@@ -1,4 +1,10 @@
+import decimal
+from datetime import date
+
+import orjson
 from flask import Flask
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
 
 from routes.maximos import bp as maximos_bp
 from routes.misc import bp as misc_bp
@@ -7,8 +13,35 @@ from routes.ventas import bp as ventas_bp
 from routes.mcp import bp as mcp_bp
 
 
+def orjson_default(o):
+    # Lo que orjson no serializa por sí mismo, igual que el proveedor de Flask.
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    option = (
+        orjson.OPT_SORT_KEYS
+        | orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_SERIALIZE_NUMPY
+        | orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=orjson_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     app.register_blueprint(ventas_bp)
     app.register_blueprint(maximos_bp)
     app.register_blueprint(sync_bp)
@@ -21,4 +54,4 @@ app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8080)
\ No newline at end of file
+    app.run(host="0.0.0.0", port=8080)
@@ -5,7 +5,13 @@ from flask import Blueprint, jsonify, request
 
 from utils.normalize import filtrar_por_fecha
 from utils.reports import run_reporte_maximos
-from utils.sheets import read_base, write_to_sheet_maximos
+from utils.sheets import (
+    DEBUG,
+    SHEETS_POOL,
+    open_spreadsheet,
+    read_base,
+    write_to_sheet_maximos,
+)
 
 bp = Blueprint("maximos", __name__)
 
@@ -14,7 +20,8 @@ bp = Blueprint("maximos", __name__)
 def run_maximos():
     try:
         data = request.get_json(force=True)
-        print(f"Request MAXIMOS: {data}", file=sys.stderr)
+        if DEBUG:
+            print(f"Request MAXIMOS: {data}", file=sys.stderr)
 
         required = [
             "spreadsheet_base_id",
@@ -27,6 +34,8 @@ def run_maximos():
             if field not in data:
                 return jsonify(status="error", error=f"Falta parámetro: {field}"), 400
 
+        # El libro de reporte se abre mientras se lee la base.
+        reporte_future = SHEETS_POOL.submit(open_spreadsheet, data["spreadsheet_reporte_id"])
         df = read_base(data["spreadsheet_base_id"], data.get("sheet_base", "BaseV"))
 
         ini = int(data["fecha_ini"])
@@ -41,6 +50,7 @@ def run_maximos():
             data["spreadsheet_reporte_id"],
             data.get("sheet_reporte", "MAXIMOS"),
             start_row=12,
+            sh=reporte_future.result(),
         )
 
         return jsonify(status="ok", tipo=tipo, rows=len(out))
@@ -3,6 +3,7 @@ import traceback
 
 from flask import Blueprint, jsonify, request
 
+from utils.normalize import filtrar_por_fecha
 from utils.sheets import read_base
 
 bp = Blueprint("misc", __name__)
@@ -13,12 +14,16 @@ def debug():
     try:
         data = request.get_json(force=True)
 
-        df = read_base(data["spreadsheet_base_id"], data.get("sheet_base", "BaseV"))
+        df = read_base(
+            data["spreadsheet_base_id"],
+            data.get("sheet_base", "BaseV"),
+            fresh=request.args.get("fresh") == "1",
+        )
 
         ini = int(data["fecha_ini"])
         fin = int(data["fecha_fin"])
 
-        df_fechas = df[(df["num_a"] >= ini) & (df["num_a"] <= fin)]
+        df_fechas = filtrar_por_fecha(df, ini, fin)
 
         info = {
             "total_rows": len(df),
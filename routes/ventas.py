@@ -1,11 +1,18 @@
 import sys
 import traceback
+from concurrent.futures import as_completed
 
 from flask import Blueprint, jsonify, request
 
 from utils.normalize import filtrar_por_fecha
-from utils.reports import run_reporte
-from utils.sheets import read_base, write_to_sheet_legacy_style
+from utils.reports import run_reporte, run_reportes
+from utils.sheets import (
+    DEBUG,
+    SHEETS_POOL,
+    open_spreadsheet,
+    read_base,
+    write_to_sheet_legacy_style,
+)
 
 bp = Blueprint("ventas", __name__)
 
@@ -14,7 +21,8 @@ bp = Blueprint("ventas", __name__)
 def run_multi():
     try:
         data = request.get_json(force=True)
-        print(f"Request VENTAS: {data}", file=sys.stderr)
+        if DEBUG:
+            print(f"Request VENTAS: {data}", file=sys.stderr)
 
         required = [
             "spreadsheet_base_id",
@@ -27,20 +35,48 @@ def run_multi():
             if field not in data:
                 return jsonify(status="error", error=f"Falta parámetro: {field}"), 400
 
+        # El libro de reporte se abre mientras se lee la base.
+        reporte_future = SHEETS_POOL.submit(open_spreadsheet, data["spreadsheet_reporte_id"])
         df = read_base(data["spreadsheet_base_id"], data.get("sheet_base", "BaseV"))
 
         ini = int(data["fecha_ini"])
         fin = int(data["fecha_fin"])
         tipo = data["tipo"]
 
+        sheet_reporte = data.get("sheet_reporte", "REPORTE VENTAS")
+
         df_fechas = filtrar_por_fecha(df, ini, fin)
+
+        if isinstance(tipo, list):
+            outs = run_reportes(tipo, df_fechas)
+
+            # La escritura a Sheets es sólo I/O: se lanzan todas en paralelo.
+            sh = reporte_future.result()
+            futures = [
+                SHEETS_POOL.submit(
+                    write_to_sheet_legacy_style,
+                    out,
+                    data["spreadsheet_reporte_id"],
+                    f"{sheet_reporte}_{t}",
+                    start_row=26,
+                    sh=sh,
+                )
+                for t, out in outs.items()
+            ]
+            for future in as_completed(futures):
+                future.result()
+
+            resultados = {t: len(out) for t, out in outs.items()}
+            return jsonify(status="ok", tipo=tipo, resultados=resultados)
+
         out = run_reporte(tipo, df_fechas)
 
         write_to_sheet_legacy_style(
             out,
             data["spreadsheet_reporte_id"],
-            data.get("sheet_reporte", "REPORTE VENTAS"),
+            sheet_reporte,
             start_row=26,
+            sh=reporte_future.result(),
         )
 
         return jsonify(status="ok", tipo=tipo, rows=len(out))
@@ -1,194 +1,239 @@
+import re
 from datetime import datetime
+from functools import lru_cache
 
+import numpy as np
 import pandas as pd
 
 
-def safe_get(row, *keys):
+ITEM_BASE_COLS = [
+    "fecha_captura",
+    "fecha",
+    "folio",
+    "departamento",
+    "cliente",
+    "metodo_de_venta",
+    "num_sucursal",
+    "sucursal",
+    "vendedor",
+]
+ITEM_TAIL_COLS = ["tipo_de_pago", "salida"]
+ITEM_EXTRA_COLS = ["comentario_cupon", "monto_cupon", "comentario"]
+EXTRA_SOURCE_COLS = ["adicional_1", "adicional_2", "comp1", "comp2", "precio_adic_1", "precio_adic_2"]
+
+CUPON_RE = re.compile(r"chs|model|cambio|cancel|folio", re.IGNORECASE)
+COMENTARIO_RE = re.compile(r"cancel|modelo|model|cambio", re.IGNORECASE)
+CHS_RE = re.compile(r"chs", re.IGNORECASE)
+
+
+def item_columns(i):
+    if i <= 3:
+        cant = (f"cant_{i}", f"cant{i}")
+    else:
+        cant = (f"cant{i}", f"cant_{i}")
+
+    if i <= 4 or i == 9:
+        categoria = f"descr{i}_1"
+    else:
+        categoria = f"descr{i}"
+
+    return cant, categoria, f"descr{i}_2", f"precio_final_{i}"
+
+
+# Columnas de la base que leen los reportes y el sync; las demás no se descargan.
+def base_columns(items=9):
+    cols = ["num_a", *ITEM_BASE_COLS, *ITEM_TAIL_COLS, *EXTRA_SOURCE_COLS]
+    for i in range(1, items + 1):
+        cant_cols, cat_col, desc_col, precio_col = item_columns(i)
+        cols += [*cant_cols, cat_col, desc_col, precio_col]
+    return frozenset(cols)
+
+
+BASE_COLUMNS = base_columns()
+
+
+def resolve_item_columns(columns, items):
+    return _resolve_item_columns(tuple(columns), items)
+
+
+# Todas las consultas sobre una misma base comparten columnas: la resolución
+# de nombres por item se calcula una vez por encabezado.
+@lru_cache(maxsize=32)
+def _resolve_item_columns(columns, items):
+    present = set(columns)
+
+    def pick(*keys):
+        return tuple(key for key in keys if key in present)
+
+    resolved = []
+    for i in range(1, items + 1):
+        cant_cols, cat_col, desc_col, precio_col = item_columns(i)
+        resolved.append((i, pick(*cant_cols), pick(cat_col), pick(desc_col), pick(precio_col)))
+    return tuple(resolved)
+
+
+# Primer valor no nulo entre las columnas dadas, columna por columna.
+def column_or_none(df, *keys):
+    out = None
     for key in keys:
-        if key in row.index and pd.notna(row[key]):
-            return row[key]
-    return None
-
-
-def normalize_items(df, items=9, include_extras=False):
-    out = []
-
-    for _, r in df.iterrows():
-        for i in range(1, items + 1):
-            if i <= 3:
-                cant = safe_get(r, f"cant_{i}", f"cant{i}")
-            else:
-                cant = safe_get(r, f"cant{i}", f"cant_{i}")
-
-            cant = pd.to_numeric(cant, errors="coerce")
-            if pd.isna(cant) or cant <= 0:
-                continue
-
-            if i <= 4 or i == 9:
-                categoria = safe_get(r, f"descr{i}_1")
-            else:
-                categoria = safe_get(r, f"descr{i}")
-
-            descripcion = safe_get(r, f"descr{i}_2")
-            precio_final = safe_get(r, f"precio_final_{i}")
-
-            row = {
-                "fecha_captura": safe_get(r, "fecha_captura"),
-                "fecha": safe_get(r, "fecha"),
-                "folio": safe_get(r, "folio"),
-                "departamento": safe_get(r, "departamento"),
-                "cliente": safe_get(r, "cliente"),
-                "metodo_de_venta": safe_get(r, "metodo_de_venta"),
-                "num_sucursal": safe_get(r, "num_sucursal"),
-                "sucursal": safe_get(r, "sucursal"),
-                "vendedor": safe_get(r, "vendedor"),
-                "cantidad": cant,
-                "categoria": categoria,
-                "descripcion": descripcion,
-                "precio_final": precio_final,
-                "tipo_de_pago": safe_get(r, "tipo_de_pago"),
-                "salida": safe_get(r, "salida"),
-            }
-
-            if include_extras:
-                adicional_1 = str(safe_get(r, "adicional_1") or "").lower()
-                adicional_2 = str(safe_get(r, "adicional_2") or "").lower()
-
-                comentario_cupon = None
-                if any(x in adicional_1 for x in ["chs", "model", "cambio", "cancel", "folio"]):
-                    comentario_cupon = safe_get(r, "adicional_1")
-                elif any(
-                    x in adicional_2 for x in ["chs", "model", "cambio", "cancel", "folio"]
-                ):
-                    comentario_cupon = safe_get(r, "adicional_2")
-
-                monto_cupon = None
-                if "chs" in adicional_1:
-                    monto_cupon = safe_get(r, "precio_adic_1")
-                elif "chs" in adicional_2:
-                    monto_cupon = safe_get(r, "precio_adic_2")
-
-                comp1 = str(safe_get(r, "comp1") or "").lower()
-                comp2 = str(safe_get(r, "comp2") or "").lower()
-
-                comentario = None
-                if any(x in comp1 for x in ["cancel", "modelo", "model", "cambio"]):
-                    comentario = safe_get(r, "comp1")
-                elif any(x in comp2 for x in ["cancel", "modelo", "model", "cambio"]):
-                    comentario = safe_get(r, "comp2")
-
-                row["comentario_cupon"] = comentario_cupon
-                row["monto_cupon"] = monto_cupon
-                row["comentario"] = comentario
-
-            out.append(row)
-
-    return pd.DataFrame(out)
+        if key in df.columns:
+            out = df[key] if out is None else out.combine_first(df[key])
+    if out is None:
+        return pd.Series(None, index=df.index, dtype=object)
+    return out
+
+
+def lower_text(df, key):
+    col = column_or_none(df, key).astype(object)
+    return col.where(col.notna(), "").astype(str).str.lower()
+
+
+def text_contains(col, pattern):
+    # Sin copia en minúsculas: los patrones ya ignoran mayúsculas.
+    if col.dtype.kind in "iufb":
+        col = col.astype(str)
+    return col.str.contains(pattern, na=False).to_numpy(dtype=bool)
+
+
+def extras_columns(df):
+    adicional_1 = column_or_none(df, "adicional_1")
+    adicional_2 = column_or_none(df, "adicional_2")
+    comp1 = column_or_none(df, "comp1")
+    comp2 = column_or_none(df, "comp2")
+
+    comentario_cupon = np.where(
+        text_contains(adicional_1, CUPON_RE),
+        adicional_1,
+        np.where(text_contains(adicional_2, CUPON_RE), adicional_2, None),
+    )
+
+    monto_cupon = np.where(
+        text_contains(adicional_1, CHS_RE),
+        column_or_none(df, "precio_adic_1"),
+        np.where(
+            text_contains(adicional_2, CHS_RE),
+            column_or_none(df, "precio_adic_2"),
+            None,
+        ),
+    )
+
+    comentario = np.where(
+        text_contains(comp1, COMENTARIO_RE),
+        comp1,
+        np.where(text_contains(comp2, COMENTARIO_RE), comp2, None),
+    )
+
+    return pd.DataFrame(
+        {
+            "comentario_cupon": comentario_cupon,
+            "monto_cupon": monto_cupon,
+            "comentario": comentario,
+        },
+        index=df.index,
+    )
+
+
+def normalize_items(df, items=9, include_extras=False, keep_index=False, num_columna=False):
+    item_cols = resolve_item_columns(df.columns, items)
+
+    # Un hueco por (fila, item); se llenan por bloques con un cursor.
+    cap = len(df) * len(item_cols)
+    rows = np.empty(cap, dtype=np.intp)
+    nums = np.empty(cap, dtype=np.int64)
+    cantidad = np.empty(cap, dtype=np.float64)
+    categoria = np.empty(cap, dtype=object)
+    descripcion = np.empty(cap, dtype=object)
+    precio_final = np.empty(cap, dtype=object)
+
+    k = 0
+    for i, cant_cols, cat_cols, desc_cols, precio_cols in item_cols:
+        cant = pd.to_numeric(column_or_none(df, *cant_cols), errors="coerce").to_numpy()
+        sel = np.flatnonzero(cant > 0)
+        n = len(sel)
+        if not n:
+            continue
+
+        rows[k : k + n] = sel
+        nums[k : k + n] = i
+        cantidad[k : k + n] = cant[sel]
+        categoria[k : k + n] = column_or_none(df, *cat_cols).to_numpy()[sel]
+        descripcion[k : k + n] = column_or_none(df, *desc_cols).to_numpy()[sel]
+        precio_final[k : k + n] = column_or_none(df, *precio_cols).to_numpy()[sel]
+        k += n
+
+    if not k:
+        return pd.DataFrame()
+
+    # Orden estable por fila de origen: conserva el orden fila -> item.
+    order = np.argsort(rows[:k], kind="stable")
+    rows = rows[:k][order]
+
+    data = {}
+    for col in ITEM_BASE_COLS:
+        data[col] = column_or_none(df, col).array.take(rows)
+        if col == "folio" and num_columna:
+            data["num_columna"] = nums[:k][order]
+    data["cantidad"] = cantidad[:k][order]
+    data["categoria"] = categoria[:k][order]
+    data["descripcion"] = descripcion[:k][order]
+    data["precio_final"] = precio_final[:k][order]
+    for col in ITEM_TAIL_COLS:
+        data[col] = column_or_none(df, col).array.take(rows)
+
+    if include_extras:
+        extras = extras_columns(df)
+        for col in ITEM_EXTRA_COLS:
+            data[col] = extras[col].array.take(rows)
+
+    # Con keep_index cada item conserva la etiqueta de su fila de origen en df.
+    return pd.DataFrame(data, index=df.index[rows] if keep_index else None)
 
 
 def normalize_items_sync(df, items=9, include_extras=False):
-    out = []
     tipos_excluidos = {
         "cancelado", "cancelada", "Cancelada", "Cancelado", "CANCELADO", "CANCELADA",
         "Instalación", "instalación", "INSTALACIÓN"
     }
 
-    for _, r in df.iterrows():
-        tipo_pago = str(safe_get(r, "tipo_de_pago") or "").strip().lower()
-        if tipo_pago in tipos_excluidos:
-            continue
+    tipo_pago = lower_text(df, "tipo_de_pago").str.strip()
+    df = df[~tipo_pago.isin(tipos_excluidos).to_numpy()]
 
-        for i in range(1, items + 1):
-            if i <= 3:
-                cant = safe_get(r, f"cant_{i}", f"cant{i}")
-            else:
-                cant = safe_get(r, f"cant{i}", f"cant_{i}")
-
-            cant = pd.to_numeric(cant, errors="coerce")
-            if pd.isna(cant) or cant <= 0:
-                continue
-
-            if i <= 4 or i == 9:
-                categoria = safe_get(r, f"descr{i}_1")
-            else:
-                categoria = safe_get(r, f"descr{i}")
-
-            descripcion = safe_get(r, f"descr{i}_2")
-            precio_final = safe_get(r, f"precio_final_{i}")
-
-            row = {
-                "fecha_captura":   safe_get(r, "fecha_captura"),
-                "fecha":           safe_get(r, "fecha"),
-                "folio":           safe_get(r, "folio"),
-                "num_columna":     i,
-                "departamento":    safe_get(r, "departamento"),
-                "cliente":         safe_get(r, "cliente"),
-                "metodo_de_venta": safe_get(r, "metodo_de_venta"),
-                "num_sucursal":    safe_get(r, "num_sucursal"),
-                "sucursal":        safe_get(r, "sucursal"),
-                "vendedor":        safe_get(r, "vendedor"),
-                "cantidad":        cant,
-                "categoria":       categoria,
-                "descripcion":     descripcion,
-                "precio_final":    precio_final,
-                "tipo_de_pago":    safe_get(r, "tipo_de_pago"),
-                "salida":          safe_get(r, "salida"),
-            }
-
-            if include_extras:
-                adicional_1 = str(safe_get(r, "adicional_1") or "").lower()
-                adicional_2 = str(safe_get(r, "adicional_2") or "").lower()
-
-                comentario_cupon = None
-                if any(x in adicional_1 for x in ["chs", "model", "cambio", "cancel", "folio"]):
-                    comentario_cupon = safe_get(r, "adicional_1")
-                elif any(x in adicional_2 for x in ["chs", "model", "cambio", "cancel", "folio"]):
-                    comentario_cupon = safe_get(r, "adicional_2")
-
-                monto_cupon = None
-                if "chs" in adicional_1:
-                    monto_cupon = safe_get(r, "precio_adic_1")
-                elif "chs" in adicional_2:
-                    monto_cupon = safe_get(r, "precio_adic_2")
-
-                comp1 = str(safe_get(r, "comp1") or "").lower()
-                comp2 = str(safe_get(r, "comp2") or "").lower()
-
-                comentario = None
-                if any(x in comp1 for x in ["cancel", "modelo", "model", "cambio"]):
-                    comentario = safe_get(r, "comp1")
-                elif any(x in comp2 for x in ["cancel", "modelo", "model", "cambio"]):
-                    comentario = safe_get(r, "comp2")
-
-                row["comentario_cupon"] = comentario_cupon
-                row["monto_cupon"] = monto_cupon
-                row["comentario"] = comentario
-
-            out.append(row)
-
-    return pd.DataFrame(out)
+    return normalize_items(df, items=items, include_extras=include_extras, num_columna=True)
 
 
 def normalizar_para_pg(df_items: pd.DataFrame) -> list:
     seen = {}  # dedup por (folio, item_index, num_sucursal) — última ocurrencia gana
 
-    for row in df_items.itertuples(index=False):
+    # to_numeric / to_datetime una vez por columna en lugar de una vez por celda.
+    def numeric_values(col):
+        if col not in df_items.columns:
+            return [None] * len(df_items)
+        x = pd.to_numeric(df_items[col], errors="coerce").astype(float)
+        return x.astype(object).where(x.notna(), None).tolist()
+
+    def date_values(col):
+        if col not in df_items.columns:
+            return [None] * len(df_items)
+        dt = pd.to_datetime(df_items[col], dayfirst=True, errors="coerce", format="mixed")
+        return dt.dt.strftime("%Y-%m-%d").astype(object).where(dt.notna(), None).tolist()
+
+    numeric = {
+        col: numeric_values(col)
+        for col in ("num_sucursal", "cantidad", "precio_final", "monto_cupon")
+    }
+    dates = {col: date_values(col) for col in ("fecha_captura", "fecha")}
+
+    for pos, row in enumerate(df_items.itertuples(index=False)):
 
         def s(col):
             v = getattr(row, col, None)
             return None if v is None or (isinstance(v, float) and pd.isna(v)) else str(v).strip()
 
         def n(col):
-            v = getattr(row, col, None)
-            if v is None: return None
-            x = pd.to_numeric(v, errors="coerce")
-            return None if pd.isna(x) else float(x)
+            return numeric[col][pos]
 
         def d(col):
-            v = getattr(row, col, None)
-            if v is None or (isinstance(v, float) and pd.isna(v)): return None
-            dt = pd.to_datetime(v, dayfirst=True, errors="coerce")
-            return None if pd.isna(dt) else dt.strftime("%Y-%m-%d")
+            return dates[col][pos]
 
         record = {
             "folio":           s("folio"),
@@ -221,4 +266,8 @@ def normalizar_para_pg(df_items: pd.DataFrame) -> list:
 
 
 def filtrar_por_fecha(df, ini, fin):
+    if df.attrs.get("num_a_ordenado"):
+        lo = df["num_a"].searchsorted(ini, side="left")
+        hi = df["num_a"].searchsorted(fin, side="right")
+        return df.iloc[lo:hi]
     return df[(df["num_a"] >= ini) & (df["num_a"] <= fin)]
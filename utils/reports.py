@@ -1,44 +1,58 @@
+import numpy as np
 import pandas as pd
 
-from utils.normalize import normalize_items, safe_get
+from utils.normalize import normalize_items
+
+
+PAGOS_SUCURSAL = ["pago total", "puerta pagada (anticipo)", "complemento"]
+
+
+def column_isin(col, values):
+    # En columnas category se comparan los códigos enteros con np.isin en lugar
+    # de las cadenas; cualquier otro dtype usa isin normal.
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        codes = col.cat.categories.get_indexer(values)
+        return np.isin(col.cat.codes.to_numpy(), codes[codes >= 0])
+    return col.isin(values).to_numpy()
+
+
+def mask_constructora(df):
+    return column_isin(df["departamento"], ["constructora"])
+
+
+def mask_distribuidores(df):
+    return column_isin(df["departamento"], ["distribuidores"]) & column_isin(
+        df["tipo_de_pago"], ["pago"]
+    )
+
+
+def mask_sucursales(df):
+    return column_isin(df["departamento"], ["sucursal"]) & column_isin(
+        df["tipo_de_pago"], PAGOS_SUCURSAL
+    )
+
+
+def mask_general(df):
+    return column_isin(df["departamento"], ["constructora", "distribuidores"]) | mask_sucursales(df)
 
 
 def reporte_general(df):
-    filtered = df[
-        (df["departamento"].isin(["constructora", "distribuidores"]))
-        | (
-            (df["departamento"] == "sucursal")
-            & (
-                df["tipo_de_pago"].isin(
-                    ["pago total", "puerta pagada (anticipo)", "complemento"]
-                )
-            )
-        )
-    ]
-    return normalize_items(filtered)
+    return normalize_items(df[mask_general(df)])
 
 
 def reporte_constructora(df):
-    filtered = df[df["departamento"] == "constructora"]
-    return normalize_items(filtered)
+    return normalize_items(df[mask_constructora(df)])
 
 
 def reporte_distribuidores(df):
-    filtered = df[(df["departamento"] == "distribuidores") & (df["tipo_de_pago"] == "pago")]
-    return normalize_items(filtered)
+    return normalize_items(df[mask_distribuidores(df)])
 
 
 def reporte_sucursales(df):
-    filtered = df[
-        (df["departamento"] == "sucursal")
-        & (df["tipo_de_pago"].isin(["pago total", "puerta pagada (anticipo)", "complemento"]))
-    ]
-    return normalize_items(filtered, items=6, include_extras=True)
+    return normalize_items(df[mask_sucursales(df)], items=6, include_extras=True)
 
 
 def aggregate_by_sucursal_descripcion(df, items=6):
-    rows = []
-
     categorias_validas = [
         "estándar_3",
         "estandar_3",
@@ -59,53 +73,31 @@ def aggregate_by_sucursal_descripcion(df, items=6):
         "chapa",
     ]
 
-    for _, r in df.iterrows():
-        for i in range(1, items + 1):
-            if i <= 3:
-                cant = safe_get(r, f"cant_{i}", f"cant{i}")
-            else:
-                cant = safe_get(r, f"cant{i}", f"cant_{i}")
-
-            cant = pd.to_numeric(cant, errors="coerce")
-            if pd.isna(cant) or cant <= 0:
-                continue
-
-            if i <= 4 or i == 9:
-                categoria = safe_get(r, f"descr{i}_1")
-            else:
-                categoria = safe_get(r, f"descr{i}")
-
-            descripcion = safe_get(r, f"descr{i}_2")
-            if not descripcion or pd.isna(descripcion):
-                continue
-
-            categoria_lower = str(categoria).lower().strip() if categoria else ""
-            descripcion_lower = str(descripcion).lower().strip()
-
-            if categoria_lower == "servicio":
-                continue
-
-            es_valido = (categoria_lower in categorias_validas) or (
-                descripcion_lower in descripciones_especiales
-            )
-            if not es_valido:
-                continue
-
-            rows.append(
-                {
-                    "num_sucursal": safe_get(r, "num_sucursal"),
-                    "sucursal": safe_get(r, "sucursal"),
-                    "descripcion": descripcion,
-                    "cantidad": cant,
-                }
-            )
-
-    if not rows:
+    items_df = normalize_items(df, items=items)
+    if items_df.empty:
         return pd.DataFrame(columns=["num_sucursal", "sucursal", "descripcion", "cantidad_total"])
 
-    df_items = pd.DataFrame(rows)
+    descripcion = items_df["descripcion"]
+    categoria = items_df["categoria"]
+
+    descripcion_texto = descripcion.where(descripcion.notna(), "").astype(str)
+    categoria_lower = categoria.where(categoria.notna(), "").astype(str).str.lower().str.strip()
+    descripcion_lower = descripcion_texto.str.lower().str.strip()
+
+    es_valido = (
+        (descripcion_texto != "")
+        & (categoria_lower != "servicio")
+        & (
+            categoria_lower.isin(categorias_validas)
+            | descripcion_lower.isin(descripciones_especiales)
+        )
+    )
+    if not es_valido.any():
+        return pd.DataFrame(columns=["num_sucursal", "sucursal", "descripcion", "cantidad_total"])
+
+    df_items = items_df.loc[es_valido, ["num_sucursal", "sucursal", "descripcion", "cantidad"]]
     df_grouped = (
-        df_items.groupby(["num_sucursal", "sucursal", "descripcion"], as_index=False)
+        df_items.groupby(["num_sucursal", "sucursal", "descripcion"], as_index=False, dropna=False)
         .agg({"cantidad": "sum"})
         .rename(columns={"cantidad": "cantidad_total"})
     )
@@ -113,60 +105,76 @@ def aggregate_by_sucursal_descripcion(df, items=6):
 
 
 def reporte_maximos_general(df):
-    filtered = df[
-        (df["departamento"].isin(["constructora", "distribuidores"]))
-        | (
-            (df["departamento"] == "sucursal")
-            & (
-                df["tipo_de_pago"].isin(
-                    ["pago total", "puerta pagada (anticipo)", "complemento"]
-                )
-            )
-        )
-    ]
-    return aggregate_by_sucursal_descripcion(filtered)
+    return aggregate_by_sucursal_descripcion(df[mask_general(df)])
 
 
 def reporte_maximos_constructora(df):
-    filtered = df[df["departamento"] == "constructora"]
-    return aggregate_by_sucursal_descripcion(filtered)
+    return aggregate_by_sucursal_descripcion(df[mask_constructora(df)])
 
 
 def reporte_maximos_distribuidores(df):
-    filtered = df[df["departamento"] == "distribuidores"]
+    filtered = df[column_isin(df["departamento"], ["distribuidores"])]
     return aggregate_by_sucursal_descripcion(filtered)
 
 
 def reporte_maximos_sucursales(df):
-    filtered = df[
-        (df["departamento"] == "sucursal")
-        & (df["tipo_de_pago"].isin(["pago total", "puerta pagada (anticipo)", "complemento"]))
-    ]
-    return aggregate_by_sucursal_descripcion(filtered)
+    return aggregate_by_sucursal_descripcion(df[mask_sucursales(df)])
+
+
+REPORTES = {
+    "GENERAL": reporte_general,
+    "CONSTRUCTORA": reporte_constructora,
+    "DISTRIBUIDORES": reporte_distribuidores,
+    "SUCURSALES": reporte_sucursales,
+}
+
+REPORTES_MAXIMOS = {
+    "GENERAL": reporte_maximos_general,
+    "CONSTRUCTORA": reporte_maximos_constructora,
+    "DISTRIBUIDORES": reporte_maximos_distribuidores,
+    "SUCURSALES": reporte_maximos_sucursales,
+}
 
 
 def run_reporte(tipo, df):
     tipo = tipo.upper()
-    if tipo == "GENERAL":
-        return reporte_general(df)
-    if tipo == "CONSTRUCTORA":
-        return reporte_constructora(df)
-    if tipo == "DISTRIBUIDORES":
-        return reporte_distribuidores(df)
-    if tipo == "SUCURSALES":
-        return reporte_sucursales(df)
-    raise ValueError(f"Tipo no válido: {tipo}")
+    if tipo not in REPORTES:
+        raise ValueError(f"Tipo no válido: {tipo}")
+    return REPORTES[tipo](df)
+
+
+# GENERAL, CONSTRUCTORA y DISTRIBUIDORES comparten items=9 y sus filas se
+# traslapan: se normaliza una sola vez la unión y se reparte por reporte.
+REPORTES_FUSIONABLES = {
+    "GENERAL": mask_general,
+    "CONSTRUCTORA": mask_constructora,
+    "DISTRIBUIDORES": mask_distribuidores,
+}
+
+
+def run_reportes(tipos, df):
+    tipos = list(dict.fromkeys(t.upper() for t in tipos))
+    for tipo in tipos:
+        if tipo not in REPORTES:
+            raise ValueError(f"Tipo no válido: {tipo}")
+
+    fusionables = [t for t in tipos if t in REPORTES_FUSIONABLES]
+
+    resultados = {}
+    if len(fusionables) > 1:
+        masks = {t: REPORTES_FUSIONABLES[t](df) for t in fusionables}
+        union = np.logical_or.reduce(list(masks.values()))
+        # Con el índice posicional de la unión cada item apunta a su fila en union.
+        items = normalize_items(df[union].reset_index(drop=True), keep_index=True)
+        for t, mask in masks.items():
+            out = items[mask[union][items.index]] if len(items) else items
+            resultados[t] = out.reset_index(drop=True) if len(out) else pd.DataFrame()
+
+    return {t: resultados[t] if t in resultados else run_reporte(t, df) for t in tipos}
 
 
 def run_reporte_maximos(tipo, df):
     tipo = tipo.upper()
-    if tipo == "GENERAL":
-        return reporte_maximos_general(df)
-    if tipo == "CONSTRUCTORA":
-        return reporte_maximos_constructora(df)
-    if tipo == "DISTRIBUIDORES":
-        return reporte_maximos_distribuidores(df)
-    if tipo == "SUCURSALES":
-        return reporte_maximos_sucursales(df)
-    raise ValueError(f"Tipo MAXIMOS no válido: {tipo}")
-
+    if tipo not in REPORTES_MAXIMOS:
+        raise ValueError(f"Tipo MAXIMOS no válido: {tipo}")
+    return REPORTES_MAXIMOS[tipo](df)
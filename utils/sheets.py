@@ -1,11 +1,52 @@
+import glob
+import hashlib
+import os
+import re
 import sys
+import tempfile
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import gspread
+import numpy as np
 import pandas as pd
 from google.auth import default
 
+from utils.normalize import BASE_COLUMNS, item_columns
+
+BASE_CACHE_DIR = os.environ.get("BASE_CACHE_DIR", "/tmp")
+DEBUG = os.environ.get("REPORT_DEBUG") == "1"
+
+# Pool compartido para las llamadas a Sheets que sólo esperan red: abrir el
+# libro de reporte mientras se lee la base y escribir varias hojas a la vez.
+SHEETS_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sheets")
+
 _gc = None
+_base_cache = {}
+_base_cache_lock = threading.Lock()
+_base_headers = {}
+
+COLUMN_NAME_TABLE = str.maketrans(
+    {
+        " ": "_",
+        ".": "",
+        "-": "_",
+        "#": "num",
+        "á": "a",
+        "é": "e",
+        "í": "i",
+        "ó": "o",
+        "ú": "u",
+        "(": "",
+        ")": "",
+        "/": "_",
+    }
+)
+
+
+def normalize_column_name(col):
+    return str(col).strip().lower().translate(COLUMN_NAME_TABLE)
 
 
 def get_gspread_client():
@@ -16,56 +57,252 @@ def get_gspread_client():
     return _gc
 
 
-def read_base(spreadsheet_id, sheet_name):
+def get_base_version(spreadsheet_id):
     try:
-        gc = get_gspread_client()
-        ws = gc.open_by_key(spreadsheet_id).worksheet(sheet_name)
-        data = ws.get_all_records()
-
-        if not data:
-            raise ValueError(f"La hoja '{sheet_name}' está vacía")
-
-        df = pd.DataFrame(data)
-
-        column_map = {}
-        for col in df.columns:
-            normalized = (
-                str(col)
-                .strip()
-                .lower()
-                .replace(" ", "_")
-                .replace(".", "")
-                .replace("-", "_")
-                .replace("#", "num")
-                .replace("á", "a")
-                .replace("é", "e")
-                .replace("í", "i")
-                .replace("ó", "o")
-                .replace("ú", "u")
-                .replace("(", "")
-                .replace(")", "")
-                .replace("/", "_")
-            )
-            column_map[col] = normalized
-
-        df.rename(columns=column_map, inplace=True)
+        return get_gspread_client().get_file_drive_metadata(spreadsheet_id)["modifiedTime"]
+    except gspread.exceptions.APIError as e:
+        print(f"Sin modifiedTime para {spreadsheet_id}: {str(e)}", file=sys.stderr)
+        return None
+
+
+def clean_category(col, clean):
+    # La limpieza corre con kernels Arrow sobre los valores distintos (unas
+    # decenas) y no sobre cada fila; luego se reagrupan los que coinciden.
+    codes, uniques = pd.factorize(col)
+    clean_codes, categories = pd.factorize(clean(pd.Series(uniques, dtype="str")), sort=True)
+    codes = np.append(clean_codes, -1)[codes]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=col.index)
+
+
+def values_request(method, spreadsheet_id, sheet_name, ranges, **params):
+    # Los números llegan sin formato y las fechas como texto.
+    params = {
+        "valueRenderOption": "UNFORMATTED_VALUE",
+        "dateTimeRenderOption": "FORMATTED_STRING",
+        **params,
+    }
+    try:
+        return method(spreadsheet_id, ranges, params=params)
+    except gspread.exceptions.APIError as e:
+        if e.code == 404:
+            raise gspread.exceptions.SpreadsheetNotFound(spreadsheet_id) from e
+        if e.code == 400 and "Unable to parse range" in str(e):
+            raise gspread.exceptions.WorksheetNotFound(sheet_name) from e
+        raise
 
+
+def base_header(row):
+    # Encabezado normalizado sin las celdas vacías del final, que values.get
+    # rellena hasta el ancho de la fila más larga y batchGet recorta.
+    header = [normalize_column_name(col) for col in row]
+    while header and header[-1] == "":
+        header.pop()
+    return header
+
+
+def base_column_positions(header):
+    return [i for i, col in enumerate(header) if col in BASE_COLUMNS]
+
+
+def fetch_base_values(spreadsheet_id, sheet_name):
+    # Hoja completa en una sola llamada a values.get, sin pedir antes los
+    # metadatos del libro y de la hoja.
+    gc = get_gspread_client()
+    response = values_request(
+        gc.http_client.values_get,
+        spreadsheet_id,
+        sheet_name,
+        gspread.utils.absolute_range_name(sheet_name),
+    )
+    values = gspread.utils.fill_gaps(response.get("values", []))
+
+    if len(values) < 2:
+        raise ValueError(f"La hoja '{sheet_name}' está vacía")
+
+    header = base_header(values[0])
+    _base_headers[(spreadsheet_id, sheet_name)] = header
+
+    # Sólo las columnas de BASE_COLUMNS y sin las filas vacías del final: el
+    # mismo marco que arma fetch_base_columns.
+    wanted = base_column_positions(header)
+    rows = [[row[i] for i in wanted] for row in values[1:]]
+    while rows and all(val == "" for val in rows[-1]):
+        rows.pop()
+
+    if not rows:
+        raise ValueError(f"La hoja '{sheet_name}' está vacía")
+
+    # Con pyarrow instalado el dtype "str" guarda el texto en arreglos Arrow:
+    # menos memoria y los filtros/.str corren en kernels vectorizados.
+    return pd.DataFrame(rows, columns=[header[i] for i in wanted], dtype="str")
+
+
+def column_letter(index):
+    return gspread.utils.rowcol_to_a1(1, index + 1)[:-1]
+
+
+def fetch_base_columns(spreadsheet_id, sheet_name, header):
+    # Con el encabezado de la lectura anterior sólo se piden los bloques de
+    # columnas que usan los reportes, junto con la fila 1 completa. Si el
+    # encabezado cambió (columnas nuevas, movidas o renombradas) devuelve None
+    # y fetch_base relee la hoja entera.
+    wanted = base_column_positions(header)
+    if not wanted:
+        return None
+
+    runs = []
+    for i in wanted:
+        if runs and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+
+    ranges = [gspread.utils.absolute_range_name(sheet_name, "1:1")] + [
+        gspread.utils.absolute_range_name(
+            sheet_name, f"{column_letter(first)}:{column_letter(last)}"
+        )
+        for first, last in runs
+    ]
+    gc = get_gspread_client()
+    response = values_request(
+        gc.http_client.values_batch_get,
+        spreadsheet_id,
+        sheet_name,
+        ranges,
+        majorDimension="COLUMNS",
+    )
+    value_ranges = response.get("valueRanges", [])
+    if len(value_ranges) != len(ranges):
+        return None
+
+    header_row = [col[0] if col else "" for col in value_ranges[0].get("values", [])]
+    if base_header(header_row) != header:
+        return None
+
+    columns = []
+    for (first, last), value_range in zip(runs, value_ranges[1:]):
+        block = value_range.get("values", [])
+        columns += block + [[]] * (last - first + 1 - len(block))
+
+    n_rows = max(len(col) for col in columns)
+    if n_rows < 2:
+        return None
+
+    df = pd.DataFrame(
+        {k: col[1:] + [""] * (n_rows - len(col)) for k, col in enumerate(columns)},
+        dtype="str",
+    )
+    df.columns = [header[i] for i in wanted]
+    return df
+
+
+def fetch_base(spreadsheet_id, sheet_name):
+    header = _base_headers.get((spreadsheet_id, sheet_name))
+    df = fetch_base_columns(spreadsheet_id, sheet_name, header) if header else None
+    if df is None:
+        df = fetch_base_values(spreadsheet_id, sheet_name)
+
+    if DEBUG:
         print(f"Columnas encontradas: {df.columns.tolist()[:20]}...", file=sys.stderr)
 
-        df["num_a"] = pd.to_numeric(df["num_a"], errors="coerce")
+    df["num_a"] = pd.to_numeric(df["num_a"], errors="coerce", downcast="integer")
+    # La base se captura en orden: si num_a ya viene ordenado, filtrar_por_fecha
+    # puede acotar el rango con búsqueda binaria. attrs viaja en el Parquet.
+    df.attrs["num_a_ordenado"] = bool(df["num_a"].is_monotonic_increasing)
+
+    # folio se queda como texto: normalizar_para_pg lo usa en la llave del upsert.
+    numeric_cols = ["num_sucursal"]
+    for i in range(1, 10):
+        cant_cols, _, _, precio_col = item_columns(i)
+        numeric_cols += [*cant_cols, precio_col]
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    # Los reportes filtran repetidamente por estas columnas: como category los
+    # isin/== comparan códigos enteros en lugar de cadenas.
+    if "departamento" in df.columns:
+        df["departamento"] = clean_category(
+            df["departamento"], lambda s: s.str.strip().str.lower()
+        )
+
+    if "tipo_de_pago" in df.columns:
+        df["tipo_de_pago"] = clean_category(
+            df["tipo_de_pago"],
+            lambda s: s.str.strip().str.lower().str.replace(r"\s+", " ", regex=True),
+        )
+
+    return df
 
-        if "departamento" in df.columns:
-            df["departamento"] = df["departamento"].astype(str).str.strip().str.lower()
 
-        if "tipo_de_pago" in df.columns:
-            df["tipo_de_pago"] = (
-                df["tipo_de_pago"]
-                .astype(str)
-                .str.strip()
-                .str.lower()
-                .str.replace(r"\s+", " ", regex=True)
-            )
+def base_parquet_prefix(spreadsheet_id, sheet_name):
+    digest = hashlib.sha1(f"{spreadsheet_id}\0{sheet_name}".encode()).hexdigest()[:16]
+    return os.path.join(BASE_CACHE_DIR, f"base_{digest}_")
 
+
+def base_parquet_path(spreadsheet_id, sheet_name, version):
+    version = re.sub(r"\W", "", version)
+    return f"{base_parquet_prefix(spreadsheet_id, sheet_name)}{version}.parquet"
+
+
+def read_base_parquet(spreadsheet_id, sheet_name, version):
+    path = base_parquet_path(spreadsheet_id, sheet_name, version)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"No se pudo leer {path}: {str(e)}", file=sys.stderr)
+        return None
+
+
+def write_base_parquet(df, spreadsheet_id, sheet_name, version):
+    # Copia en disco del DataFrame limpio: sobrevive al reinicio del worker y
+    # evita volver a pedir la hoja a Google. Sólo se guarda la última versión.
+    path = base_parquet_path(spreadsheet_id, sheet_name, version)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=BASE_CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        df.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"No se pudo guardar {path}: {str(e)}", file=sys.stderr)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    for old_path in glob.glob(f"{base_parquet_prefix(spreadsheet_id, sheet_name)}*.parquet"):
+        if old_path != path:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+
+def read_base(spreadsheet_id, sheet_name, fresh=False):
+    try:
+        # El DataFrame limpio se reutiliza mientras el modifiedTime de Drive no
+        # cambie; quien lo recibe no debe modificarlo en sitio. Con fresh se
+        # ignoran ambas cachés y se vuelve a leer la hoja.
+        version = get_base_version(spreadsheet_id)
+        key = (spreadsheet_id, sheet_name)
+
+        with _base_cache_lock:
+            cached = _base_cache.get(key)
+        if not fresh and version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+
+        if version is None:
+            return fetch_base(spreadsheet_id, sheet_name)
+
+        df = None if fresh else read_base_parquet(spreadsheet_id, sheet_name, version)
+        if df is None:
+            df = fetch_base(spreadsheet_id, sheet_name)
+            write_base_parquet(df, spreadsheet_id, sheet_name, version)
+
+        with _base_cache_lock:
+            _base_cache[key] = (version, df)
         return df
 
     except gspread.exceptions.WorksheetNotFound:
@@ -78,18 +315,89 @@ def read_base(spreadsheet_id, sheet_name):
         raise
 
 
-def write_to_sheet_legacy_style(df, spreadsheet_id, sheet_name, start_row=26):
-    try:
-        gc = get_gspread_client()
-        sh = gc.open_by_key(spreadsheet_id)
-        ws = sh.worksheet(sheet_name)
+def open_spreadsheet(spreadsheet_id):
+    return get_gspread_client().open_by_key(spreadsheet_id)
+
+
+def get_or_create_worksheet(sh, sheet_name, rows, cols):
+    # Una sola lectura de metadatos; si la hoja no existe se crea a la medida.
+    worksheets = {ws.title: ws for ws in sh.worksheets()}
+    if sheet_name in worksheets:
+        return worksheets[sheet_name]
+    return sh.add_worksheet(title=sheet_name, rows=max(rows, 1000), cols=max(cols, 20))
+
+
+def cell_data(val):
+    if isinstance(val, (bool, np.bool_)):
+        return {"userEnteredValue": {"boolValue": bool(val)}}
+    if isinstance(val, (int, float, np.number)):
+        return {"userEnteredValue": {"numberValue": float(val)}}
+    if val == "":
+        return {}
+    return {"userEnteredValue": {"stringValue": str(val)}}
+
+
+def replace_rows(sh, ws, start_row, values):
+    # Escribe values desde A{start_row} y limpia el resto de la hoja en una sola
+    # llamada: updateCells borra las celdas del rango que no vienen en rows.
+    end_row = max(ws.row_count, start_row - 1 + len(values))
+    end_col = max(ws.col_count, max(len(row) for row in values))
+
+    requests = []
+    if end_row > ws.row_count:
+        requests.append(
+            {
+                "appendDimension": {
+                    "sheetId": ws.id,
+                    "dimension": "ROWS",
+                    "length": end_row - ws.row_count,
+                }
+            }
+        )
+    if end_col > ws.col_count:
+        requests.append(
+            {
+                "appendDimension": {
+                    "sheetId": ws.id,
+                    "dimension": "COLUMNS",
+                    "length": end_col - ws.col_count,
+                }
+            }
+        )
+    requests.append(
+        {
+            "updateCells": {
+                "range": {
+                    "sheetId": ws.id,
+                    "startRowIndex": start_row - 1,
+                    "endRowIndex": end_row,
+                    "startColumnIndex": 0,
+                    "endColumnIndex": end_col,
+                },
+                "rows": [{"values": [cell_data(val) for val in row]} for row in values],
+                "fields": "userEnteredValue",
+            }
+        }
+    )
+    sh.batch_update({"requests": requests})
+
 
-        max_rows = ws.row_count
-        max_cols = ws.col_count
+def map_distinct(col, func):
+    # func corre una vez por valor distinto; en las columnas category,
+    # factorize reutiliza los códigos en lugar de volver a comparar cadenas.
+    codes, uniques = pd.factorize(col)
+    mapped = np.array([func(val) for val in uniques] + [None], dtype=object)
+    return pd.Series(mapped[codes], index=col.index)
 
-        if max_rows >= start_row:
-            range_to_clear = f"A{start_row}:{gspread.utils.rowcol_to_a1(max_rows, max_cols)}"
-            ws.batch_clear([range_to_clear])
+
+def write_to_sheet_legacy_style(df, spreadsheet_id, sheet_name, start_row=26, sh=None):
+    # df se formatea en sitio: es la salida de un reporte y no se vuelve a usar.
+    try:
+        if sh is None:
+            sh = open_spreadsheet(spreadsheet_id)
+        ws = get_or_create_worksheet(
+            sh, sheet_name, rows=start_row + len(df), cols=len(df.columns)
+        )
 
         header_map = {
             "fecha_captura": "Fecha Captura",
@@ -113,53 +421,37 @@ def write_to_sheet_legacy_style(df, spreadsheet_id, sheet_name, start_row=26):
         }
 
         headers = [[header_map.get(col, col.replace("_", " ").title()) for col in df.columns]]
-        ws.update(f"A{start_row}", headers)
+        data = []
 
         if len(df) > 0:
-            df_formatted = df.copy()
+            if "departamento" in df.columns:
+                df["departamento"] = map_distinct(df["departamento"], str.capitalize)
 
-            if "departamento" in df_formatted.columns:
-                df_formatted["departamento"] = df_formatted["departamento"].str.capitalize()
-
-            if "tipo_de_pago" in df_formatted.columns:
-                df_formatted["tipo_de_pago"] = df_formatted["tipo_de_pago"].str.title()
-
-            def parse_date_safe(val):
-                if pd.isna(val) or str(val).strip() == "":
-                    return ""
-                try:
-                    dt = pd.to_datetime(val, errors="coerce")
-                    if pd.notna(dt):
-                        return dt.strftime("%Y-%m-%d")
-                except Exception:
-                    pass
-                return str(val)
+            if "tipo_de_pago" in df.columns:
+                df["tipo_de_pago"] = map_distinct(df["tipo_de_pago"], str.title)
 
+            # format="mixed" interpreta cada valor por separado, como lo hacía el
+            # to_datetime por celda; lo que no es fecha se deja como texto.
             for col in ["fecha_captura", "fecha"]:
-                if col in df_formatted.columns:
-                    df_formatted[col] = df_formatted[col].apply(parse_date_safe)
+                if col in df.columns:
+                    raw = df[col]
+                    fechas = pd.to_datetime(raw, errors="coerce", format="mixed")
+                    texto = raw.astype(object).where(raw.notna(), "").astype(str)
+                    texto = texto.where(texto.str.strip() != "", "")
+                    df[col] = fechas.dt.strftime("%Y-%m-%d").where(fechas.notna(), texto)
 
             numeric_cols = ["folio", "num_sucursal", "cantidad", "precio_final", "monto_cupon"]
             for col in numeric_cols:
-                if col in df_formatted.columns:
-                    df_formatted[col] = pd.to_numeric(df_formatted[col], errors="coerce")
-
-            data = []
-            for _, row in df_formatted.iterrows():
-                row_data = []
-                for col in df_formatted.columns:
-                    val = row[col]
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors="coerce")
 
-                    if pd.isna(val):
-                        row_data.append("")
-                    elif col in numeric_cols:
-                        row_data.append(val if not pd.isna(val) else "")
-                    else:
-                        row_data.append(str(val))
+            values = df.astype(object)
+            values = values.where(df.notna(), "")
+            text_cols = [col for col in values.columns if col not in numeric_cols]
+            values[text_cols] = values[text_cols].astype(str)
+            data = values.values.tolist()
 
-                data.append(row_data)
-
-            ws.update(f"A{start_row + 1}", data)
+        replace_rows(sh, ws, start_row, headers + data)
 
         print(f"Escritura VENTAS exitosa: {len(df)} filas en '{sheet_name}'", file=sys.stderr)
 
@@ -168,41 +460,27 @@ def write_to_sheet_legacy_style(df, spreadsheet_id, sheet_name, start_row=26):
         raise
 
 
-def write_to_sheet_maximos(df, spreadsheet_id, sheet_name, start_row=12):
+def write_to_sheet_maximos(df, spreadsheet_id, sheet_name, start_row=12, sh=None):
     try:
-        gc = get_gspread_client()
-        sh = gc.open_by_key(spreadsheet_id)
-        ws = sh.worksheet(sheet_name)
-
-        max_rows = ws.row_count
-        max_cols = ws.col_count
-
-        if max_rows >= start_row:
-            range_to_clear = f"A{start_row}:{gspread.utils.rowcol_to_a1(max_rows, max_cols)}"
-            ws.batch_clear([range_to_clear])
+        if sh is None:
+            sh = open_spreadsheet(spreadsheet_id)
+        ws = get_or_create_worksheet(sh, sheet_name, rows=start_row + len(df), cols=4)
 
         headers = [["Numero de Sucursal", "Sucursal", "Descripcion", "Cantidad Total"]]
-        ws.update(f"A{start_row}", headers)
+        data = []
 
         if len(df) > 0:
-            df_formatted = df.copy()
-
             numeric_cols = ["num_sucursal", "cantidad_total"]
             for col in numeric_cols:
-                if col in df_formatted.columns:
-                    df_formatted[col] = pd.to_numeric(df_formatted[col], errors="coerce")
-
-            data = []
-            for _, row in df_formatted.iterrows():
-                row_data = [
-                    row["num_sucursal"] if not pd.isna(row["num_sucursal"]) else "",
-                    str(row["sucursal"]) if not pd.isna(row["sucursal"]) else "",
-                    str(row["descripcion"]) if not pd.isna(row["descripcion"]) else "",
-                    row["cantidad_total"] if not pd.isna(row["cantidad_total"]) else "",
-                ]
-                data.append(row_data)
-
-            ws.update(f"A{start_row + 1}", data)
+                if col in df.columns:
+                    df[col] = pd.to_numeric(df[col], errors="coerce")
+
+            values = df[["num_sucursal", "sucursal", "descripcion", "cantidad_total"]]
+            values = values.astype(object).where(values.notna(), "")
+            values[["sucursal", "descripcion"]] = values[["sucursal", "descripcion"]].astype(str)
+            data = values.values.tolist()
+
+        replace_rows(sh, ws, start_row, headers + data)
 
         print(f"Escritura MAXIMOS exitosa: {len(df)} filas en '{sheet_name}'", file=sys.stderr)
 